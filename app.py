@@ -1,43 +1,183 @@
 import os
+import atexit
 import csv
-import json
-import socket
+import hashlib
+import io
+import queue
 import secrets
 import string
-from datetime import datetime
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
 from pathlib import Path
+from xml.etree import ElementTree
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import (
     Flask,
+    Request,
+    Response,
     render_template,
+    stream_template,
     request,
     redirect,
     url_for,
     flash,
 )
-from openai import OpenAI
-from docx import Document
+from markupsafe import escape
+from openai import APIConnectionError, APITimeoutError, OpenAI, RateLimitError
 from PyPDF2 import PdfReader
 
-# ---- Global network timeout baseline ----
-socket.setdefaulttimeout(5)
+try:
+    import pypdfium2 as pdfium  # native PDFium; much faster than PyPDF2
+except ImportError:
+    pdfium = None
+
+try:
+    import gspread
+    from oauth2client.service_account import ServiceAccountCredentials
+except ImportError:
+    gspread = None
+
+try:
+    import tiktoken  # exact token counts for trimming the CV
+except ImportError:
+    tiktoken = None
 
 # ---------- Flask setup ----------
 BASE_DIR = Path(__file__).resolve().parent
 
+
+class InMemoryUploadRequest(Request):
+    """
+    Keep uploads in memory. Werkzeug spools anything over 500 KB to a temp
+    file, but MAX_CONTENT_LENGTH already bounds the size and we only ever
+    parse the upload in memory, so the disk write buys nothing.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
 app = Flask(__name__, template_folder=str(BASE_DIR / "templates"))
+app.request_class = InMemoryUploadRequest
 app.secret_key = os.environ.get("SECRET_KEY", "change-me-in-production")
 
-# Folders for uploads and simple email list
-UPLOAD_FOLDER = BASE_DIR / "uploads"
-EMAIL_LIST_FILE = BASE_DIR / "email_list.csv"
+# Reject oversize uploads before Werkzeug buffers or we parse them
+MAX_UPLOAD_MB = 5
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024
 
-UPLOAD_FOLDER.mkdir(exist_ok=True)
-app.config["UPLOAD_FOLDER"] = str(UPLOAD_FOLDER)
+# Simple email list
+EMAIL_LIST_FILE = BASE_DIR / "email_list.csv"
 
 # ---------- OpenAI client ----------
 client = OpenAI(timeout=30)  # uses OPENAI_API_KEY from env
+OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
+# Optional cheaper/faster model for CVs under SHORT_CV_WORDS; unset to always
+# use OPENAI_MODEL. Repairs still go to OPENAI_MODEL.
+OPENAI_SHORT_CV_MODEL = os.environ.get("OPENAI_SHORT_CV_MODEL", "").strip()
+SHORT_CV_WORDS = 500
+
+# Opening a stream only has to wait for the first token. A request that
+# stalls past that is usually quicker to abandon and retry than to wait out.
+fast_client = OpenAI(timeout=12, max_retries=0)
+FAST_STREAM_ATTEMPTS = 2
+
+# Cap on OpenAI calls in flight from this process, so a burst of uploads
+# queues here instead of tripping the account's rate limits
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", 8))
+OPENAI_SLOT_TIMEOUT = 60
+_openai_slots = threading.BoundedSemaphore(OPENAI_MAX_CONCURRENCY)
+
+# ---------- Background work (sheet sync + email) ----------
+# Sends are I/O-bound waits on Resend, so threads are cheap; size for bursts
+BACKGROUND_WORKERS = int(os.environ.get("BACKGROUND_WORKERS", 8))
+background = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="cc-bg")
+
+# Reports are generated on their own pool, not the request thread, so a
+# browser that disconnects mid-stream doesn't cancel the OpenAI call, the
+# cache write or the email. OpenAI concurrency is capped separately.
+REPORT_WORKERS = int(os.environ.get("REPORT_WORKERS", 32))
+report_pool = ThreadPoolExecutor(max_workers=REPORT_WORKERS, thread_name_prefix="cc-report")
+
+# ---------- Shared HTTP session (keeps TLS connections to Resend alive) ----------
+http_session = requests.Session()
+http_session.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=BACKGROUND_WORKERS,
+        # POST is retried too: every send carries an Idempotency-Key, so a
+        # retry after a lost response can't deliver the email twice
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=None,
+            raise_on_status=False,
+        ),
+    ),
+)
+
+
+class TokenBucket:
+    """
+    Blocking rate limiter: `with bucket:` waits until a call is allowed.
+    Lets through bursts of up to `rate` calls, then `rate` per `per` seconds.
+    """
+
+    def __init__(self, rate: float, per: float):
+        self.capacity = rate
+        self.fill_rate = rate / per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# Stay under each service's published quota so bursts queue here instead
+# of coming back as 429s and retries
+openai_bucket = TokenBucket(int(os.environ.get("OPENAI_REQUESTS_PER_MINUTE", 500)), 60)
+sheets_bucket = TokenBucket(60, 60)  # Sheets API: 60 requests/min per user
+resend_bucket = TokenBucket(2, 1)  # Resend default: 2 requests/s
+
+
+def run_in_background(fn, *args) -> None:
+    """Submit best-effort work so it never blocks the HTTP response."""
+
+    def _task():
+        try:
+            fn(*args)
+        except Exception as e:
+            app.logger.error(f"Background task {fn.__name__} failed: {e}")
+
+    background.submit(_task)
 
 
 # ============================================================
@@ -66,11 +206,17 @@ OUTPUT FORMAT (STRICT):
 Return HTML ONLY.
 Use only: <div>, <h2>, <h3>, <p>, <ul>, <li>, <strong>
 Do NOT include <html>, <head>, <body>, CSS, or scripts.
+Do NOT wrap the output in markdown code fences (```).
+Start with <div class="section"><h2>👤 Candidate Snapshot</h2> and end with the closing </div> of the last section. No text before or after.
 
 STRUCTURE (LOCKED):
 Output exactly these sections IN THIS ORDER.
-Each section must be wrapped as:
-<div class="section"><h2>...</h2>...</div>
+Each section must follow this skeleton exactly:
+<div class="section">
+<h2>(heading from the list below, copied character for character, emoji included)</h2>
+...section content...
+<p><strong>TL;DR:</strong> ...</p>
+</div>
 
 1. <h2>👤 Candidate Snapshot</h2>
 2. <h2>🧭 Career Direction</h2>
@@ -111,9 +257,72 @@ Be realistic, practical, and school-safe.
 """.strip()
 
 
-def build_user_prompt(cv_text: str) -> str:
-    trimmed = (cv_text or "")[:9000]
-    return f"""
+# The model only ever sees this many characters of the CV...
+CV_CHAR_LIMIT = 9000
+# ...and at most this many tokens of them. Ordinary English CVs fit well
+# inside it; it only bites on token-dense text (CJK, URLs, tables of
+# numbers), where 9000 characters can cost three or four times as much.
+CV_TOKEN_LIMIT = 2500
+
+
+# tiktoken downloads its BPE table on first use, with no timeout of its own
+TIKTOKEN_LOAD_TIMEOUT = 10
+
+
+def load_cv_encoding():
+    """
+    Tokenizer for OPENAI_MODEL, or None to fall back to characters only.
+    Loads on a daemon thread so a stalled download can't hold up worker
+    boot past TIKTOKEN_LOAD_TIMEOUT; a late result is simply discarded.
+    """
+    if tiktoken is None:
+        return None
+
+    loaded = {}
+
+    def _load():
+        try:
+            try:
+                loaded["encoding"] = tiktoken.encoding_for_model(OPENAI_MODEL)
+            except KeyError:
+                loaded["encoding"] = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            loaded["error"] = e
+
+    loader = threading.Thread(target=_load, name="cc-tiktoken", daemon=True)
+    loader.start()
+    loader.join(TIKTOKEN_LOAD_TIMEOUT)
+
+    if "encoding" in loaded:
+        return loaded["encoding"]
+    reason = loaded.get("error") or f"BPE table not loaded within {TIKTOKEN_LOAD_TIMEOUT}s"
+    # Don't fail startup over it
+    app.logger.warning(f"tiktoken unavailable, trimming CVs by characters only: {reason}")
+    return None
+
+
+CV_ENCODING = load_cv_encoding()
+
+
+def trim_cv_text(cv_text: str) -> str:
+    trimmed = (cv_text or "")[:CV_CHAR_LIMIT]
+    if CV_ENCODING is not None:
+        tokens = CV_ENCODING.encode(trimmed, disallowed_special=())
+        if len(tokens) > CV_TOKEN_LIMIT:
+            trimmed = CV_ENCODING.decode(tokens[:CV_TOKEN_LIMIT])
+    return trimmed
+
+
+# Built once so every request sends a byte-identical prefix, which lets
+# OpenAI's automatic prompt caching reuse it across users. Keep per-user
+# data out of SYSTEM_PROMPT and USER_PROMPT_PREFIX, and keep the system
+# message first. Caching only applies to prefixes of 1024+ tokens.
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+# Routes every report request to the same prompt-cache shard
+PROMPT_CACHE_KEY = "careercompass-report"
+
+USER_PROMPT_PREFIX = """
 Generate the CareerCompass report using the exact HTML structure and order described in the system prompt.
 
 Important:
@@ -124,51 +333,148 @@ Important:
 
 CV TEXT:
 \"\"\"
-{trimmed}
-\"\"\"
-""".strip()
+""".lstrip()
+
+
+def build_user_prompt(cv_text: str) -> str:
+    return f"{USER_PROMPT_PREFIX}{trim_cv_text(cv_text)}\n\"\"\""
 
 
 # ============================================================
 # Extract text from uploaded file
 # ============================================================
-def extract_text_from_upload(file_storage) -> str:
-    if not file_storage or file_storage.filename == "":
-        return ""
+# A UTF-8 character is at most 4 bytes, so this always covers CV_CHAR_LIMIT characters
+MAX_TEXT_UPLOAD_BYTES = CV_CHAR_LIMIT * 4
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+W_P = W_NS + "p"
+W_R = W_NS + "r"
+W_T = W_NS + "t"
+# Run-level layout elements with a text equivalent, as python-docx renders them
+W_RUN_BREAKS = {W_NS + "tab": "\t", W_NS + "br": "\n", W_NS + "cr": "\n"}
+UNREADABLE_UPLOAD_MESSAGE = (
+    "We couldn't read that file. Please upload a PDF, DOCX or TXT file, or paste your CV text."
+)
+SCANNED_PDF_MESSAGE = (
+    "Your PDF looks like a scanned image, so we can't read its text. Please paste your CV text instead."
+)
 
-    filename = file_storage.filename
-    ext = Path(filename).suffix.lower()
 
-    # Avoid collisions in uploads
-    temp_path = UPLOAD_FOLDER / f"{secrets.token_hex(8)}_{Path(filename).name}"
-    file_storage.save(temp_path)
+def detect_upload_type(stream) -> str:
+    """
+    Identify the upload from its first bytes rather than the browser-supplied
+    filename. Returns "pdf", "docx", "txt" or "" when unsupported.
+    """
+    head = stream.read(1024)
+    stream.seek(0)
 
-    text = ""
-    try:
-        if ext == ".txt":
-            with open(temp_path, "r", encoding="utf-8", errors="ignore") as f:
-                text = f.read()
-        elif ext == ".docx":
-            doc = Document(str(temp_path))
-            text = "\n".join(p.text for p in doc.paragraphs if p.text)
-        elif ext == ".pdf":
-            with open(temp_path, "rb") as f:
-                reader = PdfReader(f)
-                chunks = []
-                for page in reader.pages:
-                    page_text = page.extract_text() or ""
-                    if page_text.strip():
-                        chunks.append(page_text)
-                text = "\n".join(chunks)
-        else:
-            text = ""
-    finally:
+    if head.startswith(b"%PDF"):
+        return "pdf"
+    if head.startswith(b"PK\x03\x04"):
+        return "docx"
+    if b"\x00" not in head:
+        return "txt"
+    return ""
+
+
+def read_pdf_pages(stream):
+    """Yield the text of each page, using PDFium when installed and PyPDF2 otherwise."""
+    if pdfium is not None:
         try:
-            temp_path.unlink()
-        except Exception:
-            pass
+            pdf = pdfium.PdfDocument(stream.read())
+        except pdfium.PdfiumError as e:
+            app.logger.warning(f"PDFium could not open upload ({e}); falling back to PyPDF2.")
+            stream.seek(0)
+        else:
+            try:
+                for page in pdf:
+                    textpage = page.get_textpage()
+                    yield textpage.get_text_range().replace("\r\n", "\n")
+                    textpage.close()
+                    page.close()
+            finally:
+                pdf.close()
+            return
+
+    reader = PdfReader(stream)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def read_docx_paragraphs(stream):
+    """
+    Yield the text of each paragraph (tables and text boxes included) by
+    streaming word/document.xml straight out of the zip. python-docx would
+    load and objectify the whole package just for us to read the w:t text.
+    """
+    with zipfile.ZipFile(stream) as package, package.open("word/document.xml") as xml:
+        parts = []
+        run_depth = 0  # w:tab also defines tab stops in paragraph properties; only count tabs in runs
+        for event, el in ElementTree.iterparse(xml, events=("start", "end")):
+            if el.tag == W_R:
+                run_depth += 1 if event == "start" else -1
+            elif event == "start":
+                continue
+            elif el.tag == W_T:
+                if el.text:
+                    parts.append(el.text)
+            elif el.tag in W_RUN_BREAKS:
+                if run_depth:
+                    parts.append(W_RUN_BREAKS[el.tag])
+            elif el.tag == W_P:
+                yield "".join(parts)
+                parts.clear()
+                el.clear()
 
-    return (text or "").strip()
+
+def extract_text_from_upload(file_storage) -> str:
+    """
+    Parse the upload straight from its in-memory stream; nothing touches disk.
+    Raises ValueError for files we can't read, so we never pay for an
+    OpenAI call on garbage input.
+    """
+    if not file_storage or file_storage.filename == "":
+        return ""
+
+    stream = file_storage.stream
+    kind = detect_upload_type(stream)
+    if not kind:
+        raise ValueError(UNREADABLE_UPLOAD_MESSAGE)
+
+    # Stop parsing once we have more text than the prompt will use
+    chunks = []
+    total = 0
+    if kind == "txt":
+        chunks.append(stream.read(MAX_TEXT_UPLOAD_BYTES).decode("utf-8", errors="ignore"))
+    elif kind == "docx":
+        try:
+            for para in read_docx_paragraphs(stream):
+                if para:
+                    chunks.append(para)
+                    total += len(para) + 1
+                    if total >= CV_CHAR_LIMIT:
+                        break
+        except Exception as e:
+            app.logger.warning(f"Upload looked like a zip but is not a readable DOCX: {e}")
+            raise ValueError(UNREADABLE_UPLOAD_MESSAGE)
+    elif kind == "pdf":
+        try:
+            for page_number, page_text in enumerate(read_pdf_pages(stream)):
+                if page_text.strip():
+                    chunks.append(page_text)
+                    total += len(page_text) + 1
+                    if total >= CV_CHAR_LIMIT:
+                        break
+                elif page_number == 0:
+                    # No text layer on page 1 means a scanned CV; don't grind
+                    # through the remaining image-only pages
+                    break
+        except Exception as e:
+            app.logger.warning(f"Upload looked like a PDF but could not be read: {e}")
+            raise ValueError(UNREADABLE_UPLOAD_MESSAGE)
+        if not chunks:
+            raise ValueError(SCANNED_PDF_MESSAGE)
+
+    return "\n".join(chunks).strip()
 
 
 # ============================================================
@@ -215,12 +521,13 @@ def report_has_required_structure(html: str) -> bool:
     return True
 
 
-def repair_report_html(cv_text: str, bad_html: str) -> str:
-    """
-    Repair pass: rewrite output into the exact 13-section structure
-    without adding new facts. Removes guessed dates/claims.
-    """
-    prompt = f"""
+# Only this much of a drifted draft is sent back for repair
+REPAIR_DRAFT_CHAR_LIMIT = 9000
+
+# Sent as a follow-up turn after the original request and the drifted
+# draft, so the system + CV prefix is byte-identical to the first call and
+# the CV isn't repeated inside the repair prompt
+REPAIR_INSTRUCTIONS = """
 Your previous output did not meet the required format.
 
 Fix it:
@@ -234,68 +541,254 @@ Fix it:
 - Improve spacing: short paragraphs, labels, bullets.
 - Do NOT rehash the CV; focus on insights.
 
-CV TEXT:
-\"\"\"
-{(cv_text or "")[:9000]}
-\"\"\"
-
-DRAFT OUTPUT:
-\"\"\"
-{(bad_html or "")[:9000]}
-\"\"\"
-
 Now output corrected HTML only.
 """.strip()
 
-    response = client.chat.completions.create(
-        model=os.environ.get("OPENAI_MODEL", "gpt-4.1-mini"),
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.2,
-        max_tokens=4200,
-    )
-    return (response.choices[0].message.content or "").strip()
-
-
-def generate_report_html(cv_text: str) -> str:
-    if not cv_text or not cv_text.strip():
-        return "<div class='section'><h2>Error</h2><p>No CV text provided.</p></div>"
-
-    model = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
-
-    try:
-        app.logger.info("Calling OpenAI for report generation...")
 
+def repair_report_html(cv_text: str, bad_html: str) -> str:
+    """
+    Repair pass: rewrite output into the exact 13-section structure
+    without adding new facts. Removes guessed dates/claims.
+    """
+    with openai_slot():
         response = client.chat.completions.create(
-            model=model,
+            model=OPENAI_MODEL,
             messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
+                SYSTEM_MESSAGE,
                 {"role": "user", "content": build_user_prompt(cv_text)},
+                {"role": "assistant", "content": (bad_html or "")[:REPAIR_DRAFT_CHAR_LIMIT]},
+                {"role": "user", "content": REPAIR_INSTRUCTIONS},
             ],
-            temperature=0.25,
+            temperature=0.2,
             max_tokens=4200,
+            prompt_cache_key=PROMPT_CACHE_KEY,
         )
+    return (response.choices[0].message.content or "").strip()
 
-        html = (response.choices[0].message.content or "").strip()
 
-        # If the model drifts, repair automatically
-        if not report_has_required_structure(html):
-            app.logger.warning("Report structure invalid — running repair pass.")
-            fixed = repair_report_html(cv_text, html)
-            return fixed or html
+REPORT_ERROR_HTML = """
+<div class='section'>
+  <h2>Temporary issue generating your report</h2>
+  <p>We ran into a problem while generating your CareerCompass report. Please try again.</p>
+</div>
+"""
+
+
+# ---------- Report cache (identical CV resubmissions) ----------
+# Exact matches only. Every report is written to one person about their own
+# CV, so serving a "similar" CV's report would show someone another
+# person's details and advice.
+REPORT_CACHE_SIZE = 256
+# Reports cite current salary ranges and job-market evidence; regenerate daily
+REPORT_CACHE_TTL_SECONDS = 86400
 
+_report_cache = OrderedDict()  # report_cache_key() -> (time.monotonic(), html), oldest first
+_report_cache_lock = threading.Lock()
+_report_inflight = {}  # report_cache_key() -> [Lock, requests holding or waiting on it]
+REPORT_COALESCE_WAIT_SECONDS = 90
+
+
+def report_model_for(cv_text: str) -> str:
+    if OPENAI_SHORT_CV_MODEL and len(cv_text.split()) < SHORT_CV_WORDS:
+        return OPENAI_SHORT_CV_MODEL
+    return OPENAI_MODEL
+
+
+def report_cache_key(cv_text: str, model: str) -> str:
+    """
+    Key on exactly what the model would see: model, prompts and the trimmed
+    CV. Whitespace is collapsed so re-pastes of the same CV still hit.
+    """
+    trimmed = " ".join(trim_cv_text(cv_text).split())
+    material = "\x1f".join([model, SYSTEM_PROMPT, USER_PROMPT_PREFIX, trimmed])
+    # blake2b is the fastest cryptographic hash in the stdlib
+    return hashlib.blake2b(material.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@contextmanager
+def report_generation_lock(key: str):
+    """
+    Serialise generation per cache key so identical CVs submitted together
+    (double clicks, impatient refreshes) cost one OpenAI call, not several.
+    Waiters give up after REPORT_COALESCE_WAIT_SECONDS and generate anyway.
+    """
+    with _report_cache_lock:
+        entry = _report_inflight.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    acquired = entry[0].acquire(timeout=REPORT_COALESCE_WAIT_SECONDS)
+    try:
+        yield
+    finally:
+        if acquired:
+            entry[0].release()
+        with _report_cache_lock:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _report_inflight[key]
+
+
+def get_cached_report(key: str):
+    with _report_cache_lock:
+        entry = _report_cache.get(key)
+        if entry is None:
+            return None
+        stored_at, html = entry
+        if time.monotonic() - stored_at > REPORT_CACHE_TTL_SECONDS:
+            del _report_cache[key]
+            return None
+        _report_cache.move_to_end(key)
         return html
 
+
+def cache_report(key: str, html: str) -> None:
+    with _report_cache_lock:
+        _report_cache[key] = (time.monotonic(), html)
+        _report_cache.move_to_end(key)
+        while len(_report_cache) > REPORT_CACHE_SIZE:
+            _report_cache.popitem(last=False)
+
+
+@contextmanager
+def openai_slot():
+    """Hold one of the OPENAI_MAX_CONCURRENCY slots for the duration of a call."""
+    if not _openai_slots.acquire(timeout=OPENAI_SLOT_TIMEOUT):
+        raise RuntimeError("Timed out waiting for a free OpenAI slot")
+    try:
+        openai_bucket.acquire()
+        yield
+    finally:
+        _openai_slots.release()
+
+
+def open_completion_stream(**kwargs):
+    """Open a streamed completion, retrying stalled attempts on the short-timeout client."""
+    for attempt in range(1, FAST_STREAM_ATTEMPTS + 1):
+        try:
+            stream = fast_client.chat.completions.create(stream=True, **kwargs)
+            app.logger.info(f"OpenAI stream opened on attempt {attempt}.")
+            return stream
+        except RateLimitError as e:
+            # An immediate retry would just be rejected again; the 30s client
+            # retries 429s itself, backing off per the Retry-After headers
+            app.logger.warning(f"OpenAI stream attempt {attempt} rate limited: {e}")
+            break
+        except (APITimeoutError, APIConnectionError) as e:
+            app.logger.warning(f"OpenAI stream attempt {attempt} failed: {e}")
+
+    app.logger.warning("Fast OpenAI attempts exhausted; falling back to the 30s client.")
+    return client.chat.completions.create(stream=True, **kwargs)
+
+
+def stream_report_html(cv_text: str, result: dict):
+    """
+    Yield report HTML as the model produces it so the browser can start
+    painting sections immediately.
+
+    When the generator is exhausted, result["html"] holds the final report.
+    If the streamed draft had to be repaired (or failed part-way),
+    result["replaced"] is True and the page should swap the draft out.
+    """
+    result["html"] = ""
+    result["replaced"] = False
+
+    if not cv_text or not cv_text.strip():
+        result["html"] = "<div class='section'><h2>Error</h2><p>No CV text provided.</p></div>"
+        yield result["html"]
+        return
+
+    model = report_model_for(cv_text)
+    cache_key = report_cache_key(cv_text, model)
+    # A double submit waits for the first run and then hits the cache
+    with report_generation_lock(cache_key):
+        cached = get_cached_report(cache_key)
+        if cached is not None:
+            app.logger.info("Serving report from cache; skipping OpenAI.")
+            result["html"] = cached
+            yield cached
+            return
+
+        parts = []
+
+        try:
+            app.logger.info("Calling OpenAI for report generation (streaming)...")
+
+            with openai_slot():
+                stream = open_completion_stream(
+                    model=model,
+                    messages=[
+                        SYSTEM_MESSAGE,
+                        {"role": "user", "content": build_user_prompt(cv_text)},
+                    ],
+                    temperature=0.25,
+                    max_tokens=4200,
+                    prompt_cache_key=PROMPT_CACHE_KEY,
+                )
+
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+
+        except Exception as e:
+            app.logger.error(f"OpenAI API error: {e}")
+            result["html"] = REPORT_ERROR_HTML
+            if parts:
+                result["replaced"] = True
+            else:
+                yield REPORT_ERROR_HTML
+            return
+
+        html = "".join(parts).strip()
+
+        # If the model drifts, repair automatically
+        well_formed = report_has_required_structure(html)
+        if not well_formed:
+            app.logger.warning("Report structure invalid — running repair pass.")
+            try:
+                fixed = repair_report_html(cv_text, html)
+            except Exception as e:
+                app.logger.error(f"OpenAI API error during repair pass: {e}")
+                fixed = ""
+            if fixed:
+                html = fixed
+                result["replaced"] = True
+                well_formed = report_has_required_structure(html)
+
+        # Only keep reports that came out well-formed
+        if well_formed:
+            cache_report(cache_key, html)
+
+        result["html"] = html
+
+
+def generate_report_in_background(
+    cv_text: str,
+    report: dict,
+    chunks: queue.Queue,
+    email: str,
+    referral_code: str,
+    feedback_form_url: str,
+) -> None:
+    """
+    Run stream_report_html() to the end, passing each piece to `chunks` for
+    the response to stream, then put None to mark the end. Keeps going if
+    nobody is reading any more, and emails the finished report either way.
+    """
+    try:
+        for chunk in stream_report_html(cv_text, report):
+            chunks.put(chunk)
     except Exception as e:
-        app.logger.error(f"OpenAI API error: {e}")
-        return """
-        <div class='section'>
-          <h2>Temporary issue generating your report</h2>
-          <p>We ran into a problem while generating your CareerCompass report. Please try again.</p>
-        </div>
-        """
+        app.logger.error(f"Report generation failed: {e}")
+        report["html"] = REPORT_ERROR_HTML
+        report["replaced"] = True
+        return
+    finally:
+        chunks.put(None)
+
+    run_in_background(send_report_email, email, report["html"], referral_code, feedback_form_url)
 
 
 # ============================================================
@@ -307,131 +800,408 @@ def generate_referral_code(email: str) -> str:
         prefix = "CC"
     else:
         local_part = email.split("@")[0]
-        letters = [ch for ch in local_part if ch.isalpha()]
-        prefix = "".join(letters[:2]).upper() or "CC"
+        letters = islice((ch for ch in local_part if ch.isalpha()), 2)
+        prefix = "".join(letters).upper() or "CC"
 
-    digits = "".join(secrets.choice(string.digits) for _ in range(4))
-    return prefix + digits
+    return f"{prefix}{secrets.randbelow(10000):04d}"
 
 
 # ============================================================
 # Save email locally
 # ============================================================
-def save_email_to_list(email: str) -> None:
+_timestamp_cache = (0, "")  # (unix second, its ISO-8601 form)
+
+
+def utc_timestamp() -> str:
+    """ISO-8601 UTC time to the second, formatted at most once per second."""
+    global _timestamp_cache
+
+    now = int(time.time())
+    second, text = _timestamp_cache
+    if now != second:
+        text = datetime.fromtimestamp(now, timezone.utc).isoformat()
+        # One tuple assignment, so concurrent readers never see a torn pair
+        _timestamp_cache = (now, text)
+    return text
+
+
+def load_known_emails() -> set:
+    if not EMAIL_LIST_FILE.exists():
+        return set()
+
+    with EMAIL_LIST_FILE.open(newline="", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader, None)  # header
+        return {row[0].strip().lower() for row in reader if row and row[0].strip()}
+
+
+known_emails = load_known_emails()
+_email_list_lock = threading.Lock()
+_email_list_file = None  # opened once, kept open for the life of the process
+_email_list_writer = None  # csv.writer over _email_list_file
+
+
+def save_email_to_list(email: str) -> bool:
+    """Append the email to the local CSV. Returns False if it was already listed."""
+    global _email_list_file, _email_list_writer
+
     email = (email or "").strip().lower()
     if not email:
-        return
+        return False
+
+    with _email_list_lock:
+        if email in known_emails:
+            return False
 
-    file_exists = EMAIL_LIST_FILE.exists()
-    with EMAIL_LIST_FILE.open(mode="a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        if not file_exists:
-            writer.writerow(["email", "timestamp_utc"])
-        writer.writerow([email, datetime.utcnow().isoformat()])
+        if _email_list_file is None:
+            file_exists = EMAIL_LIST_FILE.exists()
+            # Line-buffered so each row hits the file as soon as it is written
+            _email_list_file = EMAIL_LIST_FILE.open(
+                mode="a", newline="", encoding="utf-8", buffering=1
+            )
+            _email_list_writer = csv.writer(_email_list_file)
+            if not file_exists:
+                _email_list_writer.writerow(["email", "timestamp_utc"])
+
+        _email_list_writer.writerow([email, utc_timestamp()])
+        known_emails.add(email)
+
+    return True
+
+
+def close_email_list() -> None:
+    """Close the long-lived CSV handle; registered to run when the worker exits."""
+    global _email_list_file, _email_list_writer
+
+    with _email_list_lock:
+        if _email_list_file is not None:
+            _email_list_file.close()
+            _email_list_file = None
+            _email_list_writer = None
+
+
+atexit.register(close_email_list)
 
 
 # ============================================================
-# Sync email to Google Sheets (primary)
+# Google Sheets: cached client, worksheets and known emails
 # ============================================================
-def sync_email_to_sheet(email: str) -> None:
-    email = (email or "").strip().lower()
-    if not email:
-        return
+GOOGLE_SCOPE = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
 
-    creds_json = os.environ.get("GOOGLE_SERVICE_JSON")
-    if not creds_json:
-        app.logger.warning("GOOGLE_SERVICE_JSON not set; skipping sheet sync.")
-        return
+_gs_lock = threading.Lock()
+_gs_client = None
+_worksheets = {}  # (sheet name, worksheet name) -> gspread Worksheet
+_sheet_emails = {}  # (sheet name, worksheet name) -> set of lowercased emails
+_sheet_emails_loaded_at = {}  # (sheet name, worksheet name) -> time.monotonic()
+SHEET_EMAILS_TTL_SECONDS = 600
+# (connect, read) seconds for every Sheets API call
+SHEETS_TIMEOUT = (3.05, 10)
+
+
+def get_worksheet(
+    sheet_name: str,
+    worksheet_name: str = None,
+    label: str = "sheet",
+    spreadsheet_id: str = None,
+):
+    """
+    Return a cached gspread worksheet, authorising and opening it on first use.
+    Opening by spreadsheet_id skips the Drive search that open-by-name needs.
+    Returns None (after logging why) when Sheets is not configured.
+    Callers must hold _gs_lock.
+    """
+    global _gs_client
 
-    try:
-        import gspread
-        from oauth2client.service_account import ServiceAccountCredentials
-    except ImportError:
-        app.logger.error("gspread/oauth2client not installed; skipping sheet sync.")
-        return
+    key = (sheet_name, worksheet_name)
+    if key in _worksheets:
+        return _worksheets[key]
 
-    try:
-        info = json.loads(creds_json)
-    except json.JSONDecodeError:
-        app.logger.error("GOOGLE_SERVICE_JSON is not valid JSON; skipping sheet sync.")
-        return
+    if _gs_client is None:
+        creds_json = os.environ.get("GOOGLE_SERVICE_JSON")
+        if not creds_json:
+            app.logger.warning(f"GOOGLE_SERVICE_JSON not set; skipping {label} sync.")
+            return None
+
+        if gspread is None:
+            app.logger.error(f"gspread/oauth2client not installed; skipping {label} sync.")
+            return None
 
-    scope = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(info, scope)
-    client_gs = gspread.authorize(creds)
-
-    SHEET_NAME = "EMAIL LISTS"
-    sheet = client_gs.open(SHEET_NAME).sheet1
-
-    existing = set()
-    for row in sheet.get_all_records():
-        existing_email = (row.get("email") or "").strip().lower()
-        if existing_email:
-            existing.add(existing_email)
-
-    if email not in existing:
-        sheet.append_row([email, datetime.utcnow().isoformat()])
-        app.logger.info(f"Added {email} to primary Google Sheet.")
+        try:
+            info = orjson.loads(creds_json)
+        except orjson.JSONDecodeError:
+            app.logger.error(f"GOOGLE_SERVICE_JSON is not valid JSON; skipping {label} sync.")
+            return None
+
+        creds = ServiceAccountCredentials.from_json_keyfile_dict(info, GOOGLE_SCOPE)
+        _gs_client = gspread.authorize(creds)
+        _gs_client.set_timeout(SHEETS_TIMEOUT)
+
+    if spreadsheet_id:
+        spreadsheet = _gs_client.open_by_key(spreadsheet_id)
     else:
-        app.logger.info(f"Email {email} already in primary Google Sheet; skipping.")
+        spreadsheet = _gs_client.open(sheet_name)
+    sheet = spreadsheet.worksheet(worksheet_name) if worksheet_name else spreadsheet.sheet1
+    _worksheets[key] = sheet
+    return sheet
+
+
+def get_sheet_emails(sheet, sheet_name: str, worksheet_name: str = None) -> set:
+    """
+    Emails already in the sheet, loaded from column A (header skipped) and
+    kept up to date in memory as we append. Re-read every
+    SHEET_EMAILS_TTL_SECONDS to pick up rows added outside this process
+    (sync_emails.py, manual edits). Callers must hold _gs_lock.
+    """
+    key = (sheet_name, worksheet_name)
+    now = time.monotonic()
+    if key not in _sheet_emails or now - _sheet_emails_loaded_at[key] > SHEET_EMAILS_TTL_SECONDS:
+        with sheets_bucket:
+            column = sheet.col_values(1)
+        loaded = {value.strip().lower() for value in column[1:] if value.strip()}
+        # Update in place: queued-but-unwritten emails must stay known
+        _sheet_emails.setdefault(key, set()).update(loaded)
+        _sheet_emails_loaded_at[key] = now
+    return _sheet_emails[key]
+
+
+def reset_worksheet(key: tuple) -> None:
+    """
+    Drop the cached client, worksheet and email set after an auth or
+    not-found error (revoked key, renamed or re-shared sheet), so the next
+    sync re-authorises and reopens instead of failing until a restart.
+    Callers must hold _gs_lock.
+    """
+    global _gs_client
+
+    app.logger.warning(f"Resetting cached Google Sheets handles for {key}.")
+    _gs_client = None
+    _worksheets.pop(key, None)
+    _sheet_emails.pop(key, None)
+
+
+# ---------- Batched appends ----------
+# Rows are queued and written by one background thread, so a burst of
+# signups costs one append_rows call per sheet instead of one call per user.
+SHEET_BATCH_SIZE = 100
+SHEET_FLUSH_SECONDS = 2
+# Failed appends stay with the writer and are retried with doubling delays.
+# Signups are only synced once (when first saved to the CSV), so nothing
+# else would ever retry them.
+SHEET_RETRY_MIN_SECONDS = 5
+SHEET_RETRY_MAX_SECONDS = 300
+SHEET_RETRY_ATTEMPTS = 10
+
+_sheet_rows = queue.Queue()  # ((sheet name, worksheet name), [email, timestamp])
+_sheet_stop = threading.Event()
+_sheet_writer_thread = None
+
+
+def queue_sheet_row(key: tuple, row: list) -> None:
+    """Queue a row for the sheet writer thread. Callers must hold _gs_lock."""
+    global _sheet_writer_thread
+
+    _sheet_rows.put((key, row))
+    if _sheet_writer_thread is None:
+        _sheet_writer_thread = threading.Thread(target=_sheet_writer, name="cc-sheets", daemon=True)
+        _sheet_writer_thread.start()
+
+
+def _write_sheet_batch(batch: list) -> list:
+    """Append the batch, one call per worksheet. Returns the items that failed."""
+    rows_by_sheet = {}
+    for key, row in batch:
+        rows_by_sheet.setdefault(key, []).append(row)
+
+    failed = []
+    for key, rows in rows_by_sheet.items():
+        name = " / ".join(part for part in key if part)
+        try:
+            with _gs_lock:
+                # Reopen handles dropped by reset_worksheet() after an earlier error
+                sheet = _worksheets.get(key) or reopen_worksheet(key)
+            if sheet is None:
+                raise RuntimeError("worksheet is not available")
+            with sheets_bucket:
+                # INSERT_ROWS adds fresh rows rather than overwriting any
+                # stray cells sitting just below the table
+                sheet.append_rows(rows, value_input_option="RAW", insert_data_option="INSERT_ROWS")
+            app.logger.info(f"Added {len(rows)} email(s) to Google Sheet {name}.")
+        except Exception as e:
+            app.logger.error(f"Failed to append {len(rows)} row(s) to Google Sheet {name}: {e}")
+            if getattr(e, "code", None) in (401, 403, 404):
+                with _gs_lock:
+                    reset_worksheet(key)
+            failed.extend((key, row) for row in rows)
+    return failed
+
+
+def _sheet_writer() -> None:
+    failed = []  # items whose last append failed, waiting to be retried
+    attempts = 0
+    retry_delay = SHEET_RETRY_MIN_SECONDS
+
+    while failed or not (_sheet_stop.is_set() and _sheet_rows.empty()):
+        if failed:
+            # Back off before retrying; anything queued meanwhile joins in
+            _sheet_stop.wait(retry_delay)
+            batch = failed
+        else:
+            try:
+                batch = [_sheet_rows.get(timeout=1)]
+            except queue.Empty:
+                continue
+            # Give other signups a moment to join the batch, unless shutting down
+            _sheet_stop.wait(SHEET_FLUSH_SECONDS)
+
+        while len(batch) < SHEET_BATCH_SIZE:
+            try:
+                batch.append(_sheet_rows.get_nowait())
+            except queue.Empty:
+                break
+
+        failed = _write_sheet_batch(batch)
+        if not failed:
+            attempts = 0
+            retry_delay = SHEET_RETRY_MIN_SECONDS
+            continue
+
+        attempts += 1
+        retry_delay = min(retry_delay * 2, SHEET_RETRY_MAX_SECONDS)
+        # Shutting down leaves no time to back off; one attempt is all we get
+        if attempts >= SHEET_RETRY_ATTEMPTS or _sheet_stop.is_set():
+            emails = ", ".join(row[0] for _, row in failed)
+            app.logger.error(
+                f"Giving up on {len(failed)} sheet row(s) after {attempts} attempt(s); "
+                f"they remain in {EMAIL_LIST_FILE.name}: {emails}"
+            )
+            failed = []
+            attempts = 0
+            retry_delay = SHEET_RETRY_MIN_SECONDS
+
+
+def flush_sheet_rows() -> None:
+    """Have the writer drain the queue now; registered to run when the worker exits."""
+    _sheet_stop.set()
+    if _sheet_writer_thread is not None:
+        _sheet_writer_thread.join(timeout=15)
+
+
+atexit.register(flush_sheet_rows)
 
 
 # ============================================================
-# Sync email to feedback sheet
+# Sync email to Google Sheets
 # ============================================================
-def sync_email_to_feedback_sheet(email: str) -> None:
-    email = (email or "").strip().lower()
-    if not email:
-        return
+# (spreadsheet name, worksheet name or None for the first tab, label for
+# logs, env var holding the spreadsheet ID). Add a row here to sync a new sheet.
+EMAIL_SHEETS = [
+    ("EMAIL LISTS", None, "primary sheet", "EMAIL_SHEET_ID"),
+    ("V1 Feedback Results", "User List", "feedback sheet", "FEEDBACK_SHEET_ID"),
+]
 
-    creds_json = os.environ.get("GOOGLE_SERVICE_JSON")
-    if not creds_json:
-        app.logger.warning("GOOGLE_SERVICE_JSON not set; skipping feedback sheet sync.")
-        return
 
-    try:
-        import gspread
-        from oauth2client.service_account import ServiceAccountCredentials
-    except ImportError:
-        app.logger.error("gspread/oauth2client not installed; skipping feedback sheet sync.")
-        return
+def reopen_worksheet(key: tuple):
+    """Open the EMAIL_SHEETS worksheet for `key` again. Callers must hold _gs_lock."""
+    for sheet_name, worksheet_name, label, sheet_id_env in EMAIL_SHEETS:
+        if (sheet_name, worksheet_name) == key:
+            return get_worksheet(
+                sheet_name, worksheet_name, label=label, spreadsheet_id=os.environ.get(sheet_id_env)
+            )
+    return None
 
-    try:
-        info = json.loads(creds_json)
-    except json.JSONDecodeError:
-        app.logger.error("GOOGLE_SERVICE_JSON is not valid JSON; skipping feedback sheet sync.")
+
+def sync_email_to_sheet(
+    email: str,
+    sheet_name: str,
+    worksheet_name: str,
+    label: str,
+    sheet_id_env: str,
+) -> None:
+    email = (email or "").strip().lower()
+    if not email:
         return
 
-    scope = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(info, scope)
-    client_gs = gspread.authorize(creds)
-
-    SHEET_NAME = "V1 Feedback Results"
-    WORKSHEET_NAME = "User List"
-    sheet = client_gs.open(SHEET_NAME).worksheet(WORKSHEET_NAME)
-
-    existing = set()
-    for row in sheet.get_all_records():
-        existing_email = (row.get("email") or "").strip().lower()
-        if existing_email:
-            existing.add(existing_email)
-
-    if email not in existing:
-        sheet.append_row([email, datetime.utcnow().isoformat()])
-        app.logger.info(f"Added {email} to feedback Google Sheet.")
-    else:
-        app.logger.info(f"Email {email} already in feedback Google Sheet; skipping.")
+    key = (sheet_name, worksheet_name)
+    with _gs_lock:
+        for attempt in (1, 2):
+            try:
+                sheet = get_worksheet(
+                    sheet_name, worksheet_name, label=label, spreadsheet_id=os.environ.get(sheet_id_env)
+                )
+                if sheet is None:
+                    return
+                existing = get_sheet_emails(sheet, sheet_name, worksheet_name)
+                break
+            except gspread.exceptions.APIError as e:
+                if e.code not in (401, 403, 404):
+                    raise
+                reset_worksheet(key)
+                # A fresh client fixes an expired token; a deleted or
+                # unshared sheet stays broken, so only 401 is retried
+                if attempt == 2 or e.code != 401:
+                    raise
+
+        if email in existing:
+            app.logger.info(f"Email {email} already in {label}; skipping.")
+            return
+
+        existing.add(email)
+        queue_sheet_row(key, [email, utc_timestamp()])
+
+    app.logger.info(f"Queued {email} for {label}.")
 
 
 # ============================================================
 # Send report email via Resend
 # ============================================================
+# Whole report email, parsed once at import; send_report_email() fills the
+# placeholders with a single substitute() call. Substituted values are not
+# rescanned, so a "$" inside the report itself is left untouched.
+EMAIL_TEMPLATE = string.Template(
+    """<div style='font-family: Arial, sans-serif; max-width: 720px; margin: 0 auto;'>
+        <p style="font-size:14px; line-height:1.6;">
+          Hi,<br><br>
+          Thanks for trying the CareerCompass beta. 🙌<br>
+          Your full CareerCompass report is below 👇
+        </p>
+        $feedback_block
+        <p style="font-size:14px; line-height:1.6;">
+          Your referral code: <strong>$referral_code</strong><br>
+          Share CareerCompass: <a href="$share_url" style="color:#0957D0;">$share_url</a>
+        </p>
+        <hr style="margin:18px 0; border:none; border-top:1px solid #dddddd;">
+        $report
+</div>"""
+)
+
+EMAIL_FEEDBACK_TEMPLATE = string.Template(
+    """<p style="font-size:14px; line-height:1.6;">
+          🎁 30s feedback = chance to win Lifetime Membership —
+          <a href="$feedback_form_url" style="color:#0957D0;">open feedback form</a>.
+        </p>
+        <hr style="margin:18px 0; border:none; border-top:1px solid #dddddd;">"""
+)
+
+SHARE_URL = "https://career-compass.uk"
+EMAIL_SUBJECT = "Your CareerCompass report + Lifetime Membership draw"
+
+# Resend settings are read once; changing them needs a restart, as on any deploy
+RESEND_API_KEY = os.environ.get("RESEND_API_KEY")
+RESEND_FROM_EMAIL = os.environ.get(
+    "RESEND_FROM_EMAIL",
+    "CareerCompass <report@career-compass.uk>",
+)
+RESEND_HEADERS = {
+    "Authorization": f"Bearer {RESEND_API_KEY}",
+    "Content-Type": "application/json",
+}
+if not RESEND_API_KEY:
+    app.logger.warning("RESEND_API_KEY not set; report emails will not be sent.")
+
+
 def send_report_email(
     recipient_email: str,
     html_report: str,
@@ -443,77 +1213,43 @@ def send_report_email(
         app.logger.info("No recipient email provided – skipping email send.")
         return
 
-    api_key = os.environ.get("RESEND_API_KEY")
-    if not api_key:
-        app.logger.error("RESEND_API_KEY not set; cannot send email.")
+    if not RESEND_API_KEY:
+        # Already warned once at startup
         return
 
-    from_email = os.environ.get(
-        "RESEND_FROM_EMAIL",
-        "CareerCompass <report@career-compass.uk>",
-    )
-
-    subject = "Your CareerCompass report + Lifetime Membership draw"
     feedback_form_url = (feedback_form_url or "").strip()
-    share_url = "https://career-compass.uk"
-
-    html_parts = []
-    html_parts.append("<div style='font-family: Arial, sans-serif; max-width: 720px; margin: 0 auto;'>")
-
-    html_parts.append(
-        """
-        <p style="font-size:14px; line-height:1.6;">
-          Hi,<br><br>
-          Thanks for trying the CareerCompass beta. 🙌<br>
-          Your full CareerCompass report is below 👇
-        </p>
-        """
+    # The report is our own HTML; anything else that comes from outside is escaped
+    feedback_block = (
+        EMAIL_FEEDBACK_TEMPLATE.substitute(feedback_form_url=escape(feedback_form_url))
+        if feedback_form_url
+        else ""
     )
-
-    if feedback_form_url:
-        html_parts.append(
-            f"""
-            <p style="font-size:14px; line-height:1.6;">
-              🎁 30s feedback = chance to win Lifetime Membership —
-              <a href="{feedback_form_url}" style="color:#0957D0;">open feedback form</a>.
-            </p>
-            <hr style="margin:18px 0; border:none; border-top:1px solid #dddddd;">
-            """
-        )
-
-    html_parts.append(
-        f"""
-        <p style="font-size:14px; line-height:1.6;">
-          Your referral code: <strong>{referral_code or "N/A"}</strong><br>
-          Share CareerCompass: <a href="{share_url}" style="color:#0957D0;">{share_url}</a>
-        </p>
-        <hr style="margin:18px 0; border:none; border-top:1px solid #dddddd;">
-        """
+    html_body = EMAIL_TEMPLATE.substitute(
+        feedback_block=feedback_block,
+        referral_code=escape(referral_code or "N/A"),
+        share_url=SHARE_URL,
+        report=html_report,
     )
 
-    html_parts.append(html_report)
-    html_parts.append("</div>")
-
     data = {
-        "from": from_email,
+        "from": RESEND_FROM_EMAIL,
         "to": [recipient_email],
-        "subject": subject,
-        "html": "".join(html_parts),
+        "subject": EMAIL_SUBJECT,
+        "html": html_body,
         "text": "Your CareerCompass report is included in this email.",
     }
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
+    headers = {**RESEND_HEADERS, "Idempotency-Key": secrets.token_hex(16)}
 
     try:
-        resp = requests.post(
-            "https://api.resend.com/emails",
-            headers=headers,
-            json=data,
-            timeout=10,
-        )
+        with resend_bucket:
+            resp = http_session.post(
+                "https://api.resend.com/emails",
+                headers=headers,
+                data=orjson.dumps(data),
+                # Fail fast on connect, allow time for the send itself
+                timeout=(3.05, 10),
+            )
         if 200 <= resp.status_code < 300:
             app.logger.info(f"Email sent to {recipient_email} via Resend.")
         else:
@@ -524,6 +1260,44 @@ def send_report_email(
         app.logger.error(f"Network error sending email via Resend to {recipient_email}: {e}")
 
 
+# ============================================================
+# Warm-up
+# ============================================================
+def warm_clients() -> None:
+    """
+    Pay the one-off costs (Sheets auth + worksheet lookups, DNS and TLS to
+    OpenAI and Resend) at boot instead of on the first user's request.
+    Each step is best-effort; a failure here just means the first request
+    does the work as before.
+    """
+    for sheet_name, worksheet_name, label, sheet_id_env in EMAIL_SHEETS:
+        try:
+            with _gs_lock:
+                sheet = get_worksheet(
+                    sheet_name, worksheet_name, label=label, spreadsheet_id=os.environ.get(sheet_id_env)
+                )
+                if sheet is not None:
+                    get_sheet_emails(sheet, sheet_name, worksheet_name)
+        except Exception as e:
+            app.logger.warning(f"Could not warm {label}: {e}")
+
+    try:
+        fast_client.models.list()
+    except Exception as e:
+        app.logger.warning(f"Could not warm OpenAI connection: {e}")
+
+    try:
+        http_session.head("https://api.resend.com/", timeout=5)
+    except requests.RequestException as e:
+        app.logger.warning(f"Could not warm Resend connection: {e}")
+
+    app.logger.info("Client warm-up finished.")
+
+
+if os.environ.get("WARM_CLIENTS", "1") == "1":
+    threading.Thread(target=warm_clients, name="cc-warmup", daemon=True).start()
+
+
 # ============================================================
 # Routes
 # ============================================================
@@ -532,54 +1306,81 @@ def index():
     return render_template("index.html")
 
 
+@app.errorhandler(413)
+def upload_too_large(e):
+    flash(f"File too large — please paste your CV text or upload a file under {MAX_UPLOAD_MB} MB.", "error")
+    return redirect(url_for("index"))
+
+
 @app.route("/generate", methods=["POST"])
 def generate_report():
     email = request.form.get("email", "").strip()
     text_box = request.form.get("cv_text", "").strip()
     file = request.files.get("cv_file")
 
-    file_text = extract_text_from_upload(file)
+    try:
+        file_text = extract_text_from_upload(file)
+    except ValueError as e:
+        # Only stop the user if the upload was all they gave us
+        if not text_box:
+            flash(str(e), "error")
+            return redirect(url_for("index"))
+        app.logger.warning(f"Ignoring unusable upload and using the pasted CV text: {e}")
+        file_text = ""
     combined_cv = "\n\n".join(part for part in [text_box, file_text] if part).strip()
 
     if not combined_cv:
         flash("Please paste your CV or upload a valid file.", "error")
         return redirect(url_for("index"))
 
-    report_html = generate_report_html(combined_cv)
-
     referral_code = generate_referral_code(email) if email else ""
     feedback_form_url = os.environ.get("FEEDBACK_FORM_URL", "")
 
     # best-effort email capture + sync
+    is_new_email = False
     try:
-        save_email_to_list(email)
+        is_new_email = save_email_to_list(email)
     except Exception as e:
         app.logger.error(f"Failed to save email to local CSV list: {e}")
 
-    try:
-        sync_email_to_sheet(email)
-    except Exception as e:
-        app.logger.error(f"Failed to sync email to primary Google Sheet: {e}")
-
-    try:
-        sync_email_to_feedback_sheet(email)
-    except Exception as e:
-        app.logger.error(f"Failed to sync email to feedback Google Sheet: {e}")
+    # Sheets are slow network round-trips and don't need the report, so
+    # start them now and let them overlap with generation. Returning users
+    # are already on the sheets, so only sync new emails.
+    if is_new_email:
+        for email_sheet in EMAIL_SHEETS:
+            run_in_background(sync_email_to_sheet, email, *email_sheet)
+
+    report = {}
+    chunks = queue.Queue()
+    report_pool.submit(
+        generate_report_in_background,
+        combined_cv,
+        report,
+        chunks,
+        email,
+        referral_code,
+        feedback_form_url,
+    )
 
-    # send email best effort
-    try:
-        send_report_email(email, report_html, referral_code, feedback_form_url)
-    except Exception as e:
-        app.logger.error(f"Failed to send report email: {e}")
+    def report_chunks():
+        # report["html"] and report["replaced"] are final once None arrives
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                return
+            yield chunk
 
-    return render_template(
+    page = stream_template(
         "report.html",
         email=email,
-        report_html=report_html,
+        report_chunks=report_chunks(),
+        report=report,
         download_url=None,
         referral_code=referral_code,
         feedback_form_url=feedback_form_url,
     )
+    # Stop reverse proxies from buffering the stream
+    return Response(page, mimetype="text/html", headers={"X-Accel-Buffering": "no"})
 
 
 if __name__ == "__main__":
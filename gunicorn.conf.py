@@ -0,0 +1,16 @@
+import os
+
+# Picked up automatically by `gunicorn app:app` from the working directory.
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+# One process: the report cache, known emails and sheet write queue are
+# per-process state. Threads overlap the long OpenAI waits.
+worker_class = "gthread"
+workers = 1
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+
+# A report can stream for well over a minute
+timeout = 120
+# Leave the sheet writer time to flush queued rows on shutdown
+graceful_timeout = 30
+keepalive = 5